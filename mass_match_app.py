@@ -1,15 +1,36 @@
 import streamlit as st
-import itertools, json, pandas as pd
-from supabase import create_client, Client
-from streamlit.runtime.scriptrunner import RerunException, get_script_run_ctx
-import re  # for extracting numbers from description strings
+import pandas as pd
+import numpy as np
+import httpx
+from supabase import create_client, Client, ClientOptions
+from streamlit.runtime.scriptrunner import RerunException, add_script_run_ctx, get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor
+import math
+import bisect
+import time
+from collections import Counter
+from functools import lru_cache
+from mass_search import bounded_combos, window_pairs
 
 # ════════════════════════════════════════════════
 # 🔐 Secure Supabase connection (via Streamlit Secrets)
 # ════════════════════════════════════════════════
 SUPABASE_URL = st.secrets["SUPABASE_URL"]
 SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+@st.cache_resource
+def get_supabase() -> Client:
+    # One client per server process, reused across reruns and sessions. Its
+    # pooled HTTP session keeps connections alive, so requests skip a fresh
+    # TCP + TLS handshake.
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        timeout=30,
+        http2=True,
+        follow_redirects=True,
+    )
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=http_client))
 
 # ════════════════════════════════════════════════
 # 🔁 Utility: Safe Rerun
@@ -19,30 +40,92 @@ def rerun():
     if ctx is not None:
         raise RerunException(ctx)
 
+# ════════════════════════════════════════════════
+# 🗂️ Per-session copies of the startup reads
+# ════════════════════════════════════════════════
+@st.cache_resource
+def data_versions():
+    # One counter per startup read, shared by every session of this server
+    # process: a write in any session makes all the session copies stale.
+    return {}
+
+
+def session_value(key, ttl):
+    """
+    This session's copy of a startup read, or None when it has to be loaded
+    again: never loaded, written by any session since (bump_version), or
+    older than `ttl` seconds, the TTL of the matching read cache.
+    """
+    entry = st.session_state.get(key)
+    if entry is None:
+        return None
+    if entry["ver"] != data_versions().get(key, 0) or time.monotonic() - entry["at"] >= ttl:
+        return None
+    return entry["value"]
+
+
+def keep_session_value(key, value, ver):
+    # `ver` is the version read before loading, so a write that lands while
+    # the load runs still counts as newer. An empty result (e.g. a failed
+    # read) is not kept: the next rerun asks again.
+    if value:
+        st.session_state[key] = {"value": value, "ver": ver, "at": time.monotonic()}
+
+
+def bump_version(key):
+    versions = data_versions()
+    versions[key] = versions.get(key, 0) + 1
+
 # ════════════════════════════════════════════════
 # ☁️ Dataset Helpers
 # ════════════════════════════════════════════════
-def load_datasets():
-    config = {}
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_dataset_names():
+    # Only the names are needed to fill the selectors; rows are fetched on demand.
+    res = get_supabase().table("datasets").select("name").execute()
+    return [r["name"] for r in res.data or []]
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_dataset(name):
+    res = get_supabase().table("datasets").select("*").eq("name", name).execute()
+    if not res.data:
+        return None
+    r = res.data[0]
+    return {
+        # double precision[] / text[] columns: already plain lists
+        "main": r["main_list"],
+        "list2_raw": r["list2_list"]
+    }
+
+
+# The fetch_* functions are cached separately so a failed request is not cached.
+def list_dataset_names():
     try:
-        res = supabase.table("datasets").select("*").execute()
-        for r in res.data or []:
-            config[r["name"]] = {
-                "main": json.loads(r["main_list"]),
-                "list2_raw": json.loads(r["list2_list"])
-            }
+        return fetch_dataset_names()
     except Exception as e:
         st.warning(f"Could not load datasets from Supabase: {e}")
-    return config
+        return []
+
+
+def load_one_dataset(name):
+    try:
+        return fetch_dataset(name)
+    except Exception as e:
+        st.warning(f"Could not load dataset '{name}' from Supabase: {e}")
+        return None
 
 
 def save_dataset(name, main_list, list2_list):
     try:
-        supabase.table("datasets").upsert({
+        get_supabase().table("datasets").upsert({
             "name": name,
-            "main_list": json.dumps(main_list),
-            "list2_list": json.dumps(list2_list)
+            "main_list": [float(x) for x in main_list],
+            "list2_list": [str(x) for x in list2_list]
         }).execute()
+        fetch_dataset_names.clear()
+        fetch_dataset.clear(name)
+        bump_version("dataset_names")
         return True
     except Exception as e:
         st.error(f"Save failed: {e}")
@@ -51,19 +134,23 @@ def save_dataset(name, main_list, list2_list):
 
 def rename_dataset(old, new):
     try:
-        row = supabase.table("datasets").select("*").eq("name", old).execute()
-        if row.data:
-            data = row.data[0]
-            data["name"] = new
-            supabase.table("datasets").delete().eq("name", old).execute()
-            supabase.table("datasets").upsert(data).execute()
+        # One UPDATE renames the row in place: no copy, no window without it
+        res = get_supabase().table("datasets").update({"name": new}).eq("name", old).execute()
+        if res.data:
+            fetch_dataset_names.clear()
+            fetch_dataset.clear(old)
+            fetch_dataset.clear(new)
+            bump_version("dataset_names")
     except Exception as e:
         st.error(f"Rename failed: {e}")
 
 
 def delete_dataset(name):
     try:
-        res = supabase.table("datasets").delete().eq("name", name).execute()
+        res = get_supabase().table("datasets").delete().eq("name", name).execute()
+        fetch_dataset_names.clear()
+        fetch_dataset.clear(name)
+        bump_version("dataset_names")
         if res.data:
             st.success(f"🗑️ Deleted '{name}' from cloud.")
         else:
@@ -74,45 +161,110 @@ def delete_dataset(name):
 # ════════════════════════════════════════════════
 # 🌐 Global Name Storage (Supabase)
 # ════════════════════════════════════════════════
+def bulk_upsert_global_names(rows):
+    # One round-trip for any number of {"number", "name"} rows, via the
+    # upsert_global_names function in supabase/migrations.
+    get_supabase().rpc("upsert_global_names", {"payload": rows}).execute()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_global_names():
+    res = get_supabase().table("global_names").select("*").execute()
+    if res.data and len(res.data) > 0:
+        return {r["number"]: r["name"] for r in res.data}
+
+    default_map = {
+        "-1.007": "Hydrogen loss",
+        "1.008": "Hydrogen gain",
+        "2.016": "Deuterium gain",
+        "15.995": "Oxygen gain",
+        "18.011": "Water loss",
+        "17.003": "Ammonia loss",
+        "14.003": "Nitrogen addition",
+        "43.989": "CO₂ loss"
+    }
+    bulk_upsert_global_names([{"number": k, "name": v} for k, v in default_map.items()])
+    return default_map
+
 def load_global_names():
     try:
-        res = supabase.table("global_names").select("*").execute()
-        if res.data and len(res.data) > 0:
-            return {r["number"]: r["name"] for r in res.data}
-
-        default_map = {
-            "-1.007": "Hydrogen loss",
-            "1.008": "Hydrogen gain",
-            "2.016": "Deuterium gain",
-            "15.995": "Oxygen gain",
-            "18.011": "Water loss",
-            "17.003": "Ammonia loss",
-            "14.003": "Nitrogen addition",
-            "43.989": "CO₂ loss"
-        }
-        for k, v in default_map.items():
-            supabase.table("global_names").upsert({"number": k, "name": v}).execute()
-        return default_map
+        return fetch_global_names()
     except Exception as e:
         st.error(f"Failed to load global names from Supabase: {e}")
         return {}
 
 def save_global_name(number, name):
     try:
-        supabase.table("global_names").upsert({"number": number, "name": name}).execute()
+        get_supabase().table("global_names").upsert({"number": number, "name": name}).execute()
+        fetch_global_names.clear()
+        bump_version("global_names")
         return True
     except Exception as e:
         st.error(f"Save failed: {e}")
         return False
 
+def save_global_names(names, batch_size=500):
+    # `names` maps number -> name, so a number repeated in the input is sent
+    # once (an upsert cannot touch the same row twice in one statement).
+    rows = [{"number": k, "name": v} for k, v in names.items()]
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    try:
+        # The batches hold distinct numbers, so they can go out concurrently;
+        # the pooled client keeps one connection per worker alive.
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            list(ex.map(bulk_upsert_global_names, batches))
+        return True
+    except Exception as e:
+        st.error(f"Save failed: {e}")
+        return False
+    finally:
+        # Earlier batches may have landed even if a later one failed
+        fetch_global_names.clear()
+        bump_version("global_names")
+
 def delete_global_name(number):
     try:
-        supabase.table("global_names").delete().eq("number", number).execute()
+        get_supabase().table("global_names").delete().eq("number", number).execute()
+        fetch_global_names.clear()
+        bump_version("global_names")
         return True
     except Exception as e:
         st.error(f"Delete failed: {e}")
         return False
 
+@st.cache_data(show_spinner=False)
+def build_name_index(name_map):
+    """
+    Parse the global name keys once per map. Signed keys are sorted by value
+    and unsigned ones by magnitude, as (key, map position, name), so a lookup
+    only bisects its ±tolerance window instead of scanning every entry.
+    """
+    signed, unsigned = [], []
+    for pos, (k, v) in enumerate(name_map.items()):
+        k_str = str(k).strip()
+        try:
+            k_val = float(k_str)
+        except:
+            continue
+        if k_str.startswith(('+', '-')):
+            signed.append((k_val, pos, v))
+        else:
+            unsigned.append((abs(k_val), pos, v))
+    signed.sort()
+    unsigned.sort()
+    return {
+        "signed": ([e[0] for e in signed], signed),
+        "unsigned": ([e[0] for e in unsigned], unsigned),
+    }
+
+@st.cache_data(show_spinner=False)
+def build_name_table(name_map):
+    """The global names sorted by numeric value, for the manage table."""
+    items = sorted(name_map.items(), key=lambda x: float(x[0]))
+    return pd.DataFrame({"Number": [k for k, _ in items], "Name": [v for _, v in items]})
+
+# Redefined on every rerun, so the cache only lives for one render, during
+# which GLOBAL_NAME_INDEX and the tolerance are fixed: no invalidation needed.
+@lru_cache(maxsize=2048)
 def get_global_name(num):
     """
     Global name logic (using app 'tolerance'):
@@ -123,7 +275,8 @@ def get_global_name(num):
         match both +x and -x by magnitude within ±tolerance:
             +x -> '+name'
             -x -> '-name'
-    - Returns *all* matching names as a list (may be multiple).
+    - Returns *all* matching names as a list (may be multiple), in the
+      order of the global names table.
     """
     try:
         num_f = float(num)
@@ -138,38 +291,68 @@ def get_global_name(num):
 
     matches = []
 
-    for k, v in GLOBAL_NAME_MAP.items():
-        k_str = str(k).strip()
-        try:
-            k_val = float(k_str)
-        except:
-            continue
+    # Signed entries: explicit + or -, the signed value must match within tol_val
+    keys, entries = GLOBAL_NAME_INDEX["signed"]
+    lo = bisect.bisect_left(keys, num_f - tol_val)
+    hi = bisect.bisect_right(keys, num_f + tol_val)
+    matches += [(pos, v) for _, pos, v in entries[lo:hi]]
 
-        # Signed entries: explicit + or -
-        if k_str.startswith(('+', '-')):
-            # Require the signed value to match within tol_val
-            if abs(k_val - num_f) <= tol_val:
-                matches.append(v)
+    # Unsigned entries: can match both +x and -x by magnitude
+    keys, entries = GLOBAL_NAME_INDEX["unsigned"]
+    sign = "-" if num_f < 0 else "+"
+    lo = bisect.bisect_left(keys, abs(num_f) - tol_val)
+    hi = bisect.bisect_right(keys, abs(num_f) + tol_val)
+    matches += [(pos, sign + v) for _, pos, v in entries[lo:hi]]
 
-        # Unsigned entries: can match both +x and -x by magnitude
-        else:
-            if abs(abs(k_val) - abs(num_f)) <= tol_val:
-                if num_f < 0:
-                    matches.append("-" + v)
-                else:
-                    matches.append("+" + v)
-
-    # Remove duplicates while preserving order
+    # Back to table order, removing duplicates
     seen = set()
     unique_matches = []
-    for m in matches:
+    for _, m in sorted(matches):
         if m not in seen:
             seen.add(m)
             unique_matches.append(m)
 
     return unique_matches
 
-GLOBAL_NAME_MAP = load_global_names()
+# ════════════════════════════════════════════════
+# ⚡ Startup Reads
+# ════════════════════════════════════════════════
+def parallel_fetch(selected_name=None):
+    """
+    Run the independent startup reads concurrently, so a cold start costs
+    about one round-trip instead of one per read. Returns
+    (global_name_map, dataset_names). The dataset selected on the previous
+    run, if any, is fetched alongside so load_one_dataset() finds it cached.
+
+    Not wrapped in st.cache_data itself: each read is already cached, and an
+    outer cache would keep serving data that a write has just invalidated.
+    Both results are also kept in st.session_state, so a plain widget rerun
+    returns them without a thread pool or a cache lookup. A write from any
+    session bumps the shared version and makes every copy reload.
+    """
+    versions = dict(data_versions())
+    name_map = session_value("global_names", 600)
+    names = session_value("dataset_names", 60)
+    if name_map is not None and names is not None:
+        return name_map, names
+
+    ctx = get_script_run_ctx()
+    # Workers get the script context so the loaders' st.warning/st.error work
+    with ThreadPoolExecutor(max_workers=3, initializer=add_script_run_ctx, initargs=(None, ctx)) as ex:
+        names_future = ex.submit(load_global_names) if name_map is None else None
+        datasets_future = ex.submit(list_dataset_names) if names is None else None
+        if selected_name is not None:
+            ex.submit(load_one_dataset, selected_name)
+        if names_future is not None:
+            name_map = names_future.result()
+            keep_session_value("global_names", name_map, versions.get("global_names", 0))
+        if datasets_future is not None:
+            names = datasets_future.result()
+            keep_session_value("dataset_names", names, versions.get("dataset_names", 0))
+        return name_map, names
+
+GLOBAL_NAME_MAP, dataset_names = parallel_fetch(st.session_state.get("selected_dataset"))
+GLOBAL_NAME_INDEX = build_name_index(GLOBAL_NAME_MAP)
 
 # ════════════════════════════════════════════════
 # 🧮 APP UI
@@ -201,15 +384,12 @@ else:
 
 tolerance = st.number_input("🎯 Tolerance ±", value=0.1, format="%.5f")
 
-data_config = load_datasets()
 
 # ────────────── Manage Global Names ──────────────
 with st.expander("🧩 Manage Global Modifier Names", expanded=False):
     # Current global modifiers table
     if GLOBAL_NAME_MAP:
-        st.table(pd.DataFrame(
-            [{"Number": k, "Name": v} for k, v in sorted(GLOBAL_NAME_MAP.items(), key=lambda x: float(x[0]))]
-        ))
+        st.table(build_name_table(GLOBAL_NAME_MAP))
 
     # ────────────── Manual add / update ──────────────
     st.markdown("### ➕ Add / update a single modifier")
@@ -260,7 +440,7 @@ with st.expander("🧩 Manage Global Modifier Names", expanded=False):
                 st.dataframe(gdf[[col_num, col_name]].head())
 
                 if st.button("💾 Save all modifiers from CSV"):
-                    count = 0
+                    names = {}
                     for _, row in gdf.iterrows():
                         num_raw = row[col_num]
                         name_raw = row[col_name]
@@ -274,11 +454,12 @@ with st.expander("🧩 Manage Global Modifier Names", expanded=False):
                         if not num_str or not name_str:
                             continue
 
-                        if save_global_name(num_str, name_str):
-                            count += 1
+                        names[num_str] = name_str
 
-                    st.success(f"✅ Saved / updated {count} modifiers from CSV.")
-                    rerun()
+                    # One batched upsert instead of a request per row
+                    if save_global_names(names):
+                        st.success(f"✅ Saved / updated {len(names)} modifiers from CSV.")
+                        rerun()
         except Exception as e:
             st.error(f"Failed to read CSV: {e}")
 
@@ -339,20 +520,23 @@ with st.expander("➕ Add New Dataset", expanded=False):
             st.error(f"Error saving dataset: {e}")
 
 # ────────────── Select Dataset ──────────────
-if not data_config:
+if not dataset_names:
     st.info("No datasets found.")
     st.stop()
 
 st.divider()
-selected_name = st.selectbox("Select dataset to use:", list(data_config.keys()))
-selected_data = data_config[selected_name]
+selected_name = st.selectbox("Select dataset to use:", dataset_names, key="selected_dataset")
+selected_data = load_one_dataset(selected_name)
+if selected_data is None:
+    st.info(f"Dataset '{selected_name}' could not be loaded.")
+    st.stop()
 main_list = selected_data["main"]
 list2_raw = selected_data["list2_raw"]
 st.markdown(f"**Using dataset:** `{selected_name}`  ({len(main_list)} main, {len(list2_raw)} modifiers)")
 
 # ────────────── Manage Datasets ──────────────
 with st.expander("🛠 Manage Datasets", expanded=False):
-    manage_name = st.selectbox("Choose dataset to manage:", list(data_config.keys()), key="manage")
+    manage_name = st.selectbox("Choose dataset to manage:", dataset_names, key="manage")
     col1, col2 = st.columns(2)
     with col1:
         new_name = st.text_input(f"Rename '{manage_name}' to:", "")
@@ -391,39 +575,351 @@ with st.expander("⚙️ Combination Settings", expanded=False):
 # ════════════════════════════════════════════════
 # 🧠 Calculation Helpers
 # ════════════════════════════════════════════════
-def within_tolerance(value, target_mass):
-    return abs(value - target_mass) <= tolerance
-
-def add_result(desc, val, steps, results, target_mass, prefix=None):
-    if within_tolerance(val, target_mass):
+def add_result(desc, val, steps, results, target_mass, prefix, window):
+    # `steps` are the signed shifts applied to the base mass (non-numeric
+    # markers for oligomers); they are kept so the display can name them.
+    # `window` is the precomputed (target - tol, target + tol) pair.
+    lo, hi = window
+    if lo <= val <= hi:
         err = abs(val - target_mass)
         full_desc = desc if not prefix else f"[{prefix}] {desc}"
-        results.append((len(steps), err, full_desc, val, err))
+        results["size"].append(len(steps))
+        results["err"].append(err)
+        results["desc"].append(full_desc)
+        results["val"].append(val)
+        results["steps"].append(steps)
 
-# --- Parse modifiers (handles extra quotes & exact Code 1 behaviour) ---
-list2_add, list2_sub = [], []
+def can_reach(arr, r, lo, hi):
+    # Any r values of the ascending `arr` sum to within [r*arr[0], r*arr[-1]]
+    return len(arr) > 0 and r * arr[0] <= hi and lo <= r * arr[-1]
 
-for item in list2_raw:
-    # Normalize weird Supabase cases like "'+56.06'"
-    s = str(item).strip().strip("'").strip('"')
-    try:
-        if s.startswith('+'):
-            list2_add.append(float(s[1:]))
-        elif s.startswith('-'):
-            list2_sub.append(abs(float(s)))
-        else:
-            val = float(s)
-            if val >= 0:
-                list2_add.append(val)
-                list2_sub.append(val)
+def run_search(main_list, total_main, mods, modes, target_pairs, tol, dataset_name, progress):
+    """
+    Run every enabled search mode against each (target_mass, prefix) pair.
+
+    `mods` is the parsed modifier column from parse_dataset().
+
+    `modes` holds the Combination Settings flags ("main_only", "additions",
+    "subtractions", "sub_add", "list2_only") plus "oligomer_mode" (None when
+    oligomers are off). Returns the matches built by add_result(), column
+    by column: parallel "size", "err", "desc", "val" and "steps" lists.
+    """
+    results = {"size": [], "err": [], "desc": [], "val": [], "steps": []}
+    list2_add, list2_sub = mods["add"], mods["sub"]
+    oligomer_mode = modes["oligomer_mode"]
+    done = 0
+
+    # Shorters-combos inputs do not depend on the target, so build them once
+    if modes["list2_only"]:
+        n = len(main_list)
+        main_arr = np.asarray(main_list, dtype=np.float64)
+
+        # --- Build signed modifiers from list2: +v for additions, -v for
+        # subtractions, skipping any whose magnitude is a main mass ---
+        def usable_shifts(vals):
+            on_main = (np.abs(np.abs(vals)[:, None] - main_arr[None, :]) < 1e-6).any(axis=1)
+            vals = vals[~on_main]
+            # one shift per value at 6 decimals, first occurrence kept, in order
+            _, first = np.unique(np.round(vals, 6), return_index=True)
+            return vals[np.sort(first)]
+
+        signed_mods = (
+            usable_shifts(mods["add_arr"]).tolist()
+            + (-usable_shifts(mods["sub_arr"])).tolist()
+        )
+
+        # --- All one- and two-modifier shifts as arrays, tested per base mass ---
+        mods_arr = np.asarray(signed_mods, dtype=np.float64)
+        # (i, j) with i <= j, in combinations_with_replacement order
+        pair_idx = np.column_stack(np.triu_indices(len(signed_mods)))
+        pair_sums = mods_arr[pair_idx].sum(axis=1)
+        # Sorted once, so each base mass binary-searches its window in them
+        single_order = np.argsort(mods_arr, kind="stable")
+        single_sorted = mods_arr[single_order]
+        pair_order = np.argsort(pair_sums, kind="stable")
+        pair_sorted = pair_sums[pair_order]
+
+        # --- Prefix sums to get fragment masses quickly ---
+        prefix_sums = np.zeros(n + 1, dtype=np.float64)
+        np.cumsum(main_arr, out=prefix_sums[1:])
+
+        # --- Every base mass the fragment search tries: each contiguous
+        # fragment i..j (frag_start/frag_end, in loop order), then each
+        # one-time substitution of position k by a differing neighbour AA
+        # inside it (base_frag/base_pos/base_neigh; -1 for plain fragments) ---
+        frag_start, frag_end = np.triu_indices(n + 1, k=1)
+        frag_sums = prefix_sums[frag_end] - prefix_sums[frag_start]
+        base_frag = [np.arange(len(frag_sums))]
+        base_pos = [np.full(len(frag_sums), -1)]
+        base_neigh = [np.full(len(frag_sums), -1)]
+        base_parts = [frag_sums]
+        for k in range(n):
+            inside = np.nonzero((frag_start <= k) & (k < frag_end))[0]
+            for neigh_idx in (k - 1, k + 1):
+                if not 0 <= neigh_idx < n or abs(main_arr[neigh_idx] - main_arr[k]) < 1e-9:
+                    continue
+                base_frag.append(inside)
+                base_pos.append(np.full(len(inside), k))
+                base_neigh.append(np.full(len(inside), neigh_idx))
+                base_parts.append(frag_sums[inside] - main_arr[k] + main_arr[neigh_idx])
+        base_frag, base_pos, base_neigh = (np.concatenate(a) for a in (base_frag, base_pos, base_neigh))
+        base_arr = np.concatenate(base_parts)
+        bases = base_arr.tolist()
+
+        @lru_cache(maxsize=None)
+        def base_label(b):
+            f, k = base_frag[b], base_pos[b]
+            label = f"frag {frag_start[f] + 1}-{frag_end[f]}"
+            if k < 0:
+                return label
+            old_mass, subst_mass = main_list[k], main_list[base_neigh[b]]
+            return f"{label} subst pos{k - frag_start[f] + 1} {old_mass:.5f}->{subst_mass:.5f}"
+
+        def base_steps(b):
+            # a substitution records its mass change as the first step
+            return [] if base_pos[b] < 0 else [bases[b] - float(frag_sums[base_frag[b]])]
+
+    # "- and +" pairs: (total_main - sub) + add, searched like the fragment
+    # bases against the ascending "+" values
+    if modes["sub_add"]:
+        sub_add_bases = total_main - mods["sub_arr"]
+
+    # --- Exact candidate count, so the progress bar tracks the real work ---
+    n_add, n_sub = len(list2_add), len(list2_sub)
+    per_target = 0
+    if modes["main_only"]:
+        per_target += 1
+    if modes["additions"]:
+        per_target += sum(math.comb(n_add + r - 1, r) for r in range(1, 4))
+    if modes["subtractions"]:
+        per_target += sum(math.comb(n_sub + r - 1, r) for r in range(1, 4))
+    if modes["sub_add"]:
+        per_target += n_sub * n_add
+    if oligomer_mode is not None:
+        per_target += 3 * (2 if oligomer_mode == "Cyclic Monomer" else 3)
+    if modes["list2_only"]:
+        # every base mass is tried alone, with one mod and with a pair of mods
+        per_base = 1 + len(pair_sums) + len(mods_arr)
+        per_target += len(bases) * per_base
+    total = max(1, per_target * len(target_pairs))
+    last_update = time.monotonic()
+
+    def tick(count):
+        # Redraw at most every 0.1 s, however many stages report in between
+        nonlocal done, last_update
+        done += count
+        now = time.monotonic()
+        if now - last_update >= 0.1:
+            progress.progress(min(done / total, 1.0))
+            last_update = now
+
+    # --- Candidates that do not depend on the target (main-only and the
+    # oligomers): built once, matched against every target in one broadcast ---
+    fixed = []  # (desc, mass, steps)
+    if modes["main_only"]:
+        fixed.append((f"{dataset_name} only", total_main, []))
+
+    # ────────────── NEW: Oligomers (Dimer/Trimer/Tetramer) ──────────────
+    if oligomer_mode is not None:
+        # X = 2,3,4 -> Dimer, Trimer, Tetramer
+        oligo_names = {2: "Dimer", 3: "Trimer", 4: "Tetramer"}
+        H2 = 2.014  # mass difference for H2 (used in your formulas)
+
+        for X in (2, 3, 4):
+            label = oligo_names[X]
+
+            if oligomer_mode == "Cyclic Monomer":
+                # 1) Cyclic Oligomer: sum_main * X
+                cyclic_mass = total_main * X
+                # 2) Linear Oligomer: sum_main * X + 2.014
+                linear_mass = total_main * X + H2
+
+                # Peptide-bound oligomer is NOT defined for Cyclic Monomer mode
+                peptide_mass = None
+
+            else:
+                # oligomer_mode == "Linear Monomer"
+                # 1) Cyclic Oligomer:
+                #    sum_main * X - ((X-1) * 2.014) - 2.014
+                cyclic_mass = total_main * X - ((X - 1) * H2) - H2
+                # 2) Linear Oligomer:
+                #    sum_main * X - ((X-1) * 2.014)
+                linear_mass = total_main * X - ((X - 1) * H2)
+                # 3) Peptide-bound oligomer:
+                #    sum_main * X  (your new rule)
+                peptide_mass = total_main * X
+
+            fixed.append((f"Cyclic {label}", cyclic_mass, [("oligomer", X, "cyclic")]))
+            fixed.append((f"Linear {label}", linear_mass, [("oligomer", X, "linear")]))
+            # Peptide-bound oligomer (only for Linear Monomer mode)
+            if peptide_mass is not None:
+                fixed.append((f"Peptide-bound {label}", peptide_mass, [("oligomer", X, "peptide_bound")]))
+
+    if fixed and target_pairs:
+        targets = np.array([t for t, _ in target_pairs])
+        fixed_vals = np.array([m for _, m, _ in fixed])
+        # Same arithmetic as the per-target windows below
+        los, his = targets - tol, targets + tol
+        in_window = (fixed_vals[:, None] >= los) & (fixed_vals[:, None] <= his)
+        for c, t in zip(*np.nonzero(in_window)):
+            desc, val, steps = fixed[c]
+            target_mass, prefix = target_pairs[t]
+            add_result(desc, val, steps, results, target_mass, prefix, (los[t], his[t]))
+        tick(len(fixed) * len(target_pairs))
+
+    for target_mass, prefix in target_pairs:
+        window = lo, hi = target_mass - tol, target_mass + tol
+
+        # Window the modifier sum itself must fall into; the small slack
+        # leaves the exact boundary decision to add_result().
+        delta = target_mass - total_main
+        slack = tol + 1e-9
+
+        # + modifiers
+        if modes["additions"]:
+            for r in range(1, 4):
+                if can_reach(mods["add_arr"], r, delta - slack, delta + slack):
+                    # Only combinations inside the tolerance window are generated
+                    idx, sums = bounded_combos(mods["add_arr"], r, delta - slack, delta + slack)
+                    vals = total_main + sums
+                    for row in np.nonzero((vals >= lo) & (vals <= hi))[0]:
+                        combo = tuple(list2_add[i] for i in idx[row])
+                        add_result(f"+{combo}", vals[row], combo, results, target_mass, prefix, window)
+                tick(math.comb(n_add + r - 1, r))
+
+        # - modifiers
+        if modes["subtractions"]:
+            for r in range(1, 4):
+                if can_reach(mods["sub_arr"], r, -delta - slack, -delta + slack):
+                    idx, sums = bounded_combos(mods["sub_arr"], r, -delta - slack, -delta + slack)
+                    vals = total_main - sums
+                    # A value can only be subtracted as often as it was listed
+                    taken = (idx[:, :, None] == idx[:, None, :]).sum(axis=2)
+                    ok = (vals >= lo) & (vals <= hi) & (taken <= mods["sub_limit"][idx]).all(axis=1)
+                    for row in np.nonzero(ok)[0]:
+                        combo = tuple(list2_sub[i] for i in idx[row])
+                        steps = [-x for x in combo]
+                        add_result(f"-{combo}", vals[row], steps, results, target_mass, prefix, window)
+                tick(math.comb(n_sub + r - 1, r))
+
+        # - and +
+        if modes["sub_add"]:
+            # Only the "+" values inside each "-" value's window are visited
+            sub_idx, add_idx = window_pairs(sub_add_bases, mods["add_arr"], lo, hi)
+            for i, j in zip(sub_idx, add_idx):
+                sub, add = list2_sub[i], list2_add[j]
+                if sub == add:
+                    continue
+                add_result(
+                    f"-({sub},) +({add},)",
+                    total_main - sub + add,
+                    [-sub, add],
+                    results,
+                    target_mass,
+                    prefix,
+                    window,
+                )
+            tick(n_sub * n_add)
+
+        # ────────────── NEW Shorters-combos (List2-only logic) ──────────────
+        if modes["list2_only"]:
+            # ==========================================
+            # Fragments of main_list with optional list2 mods
+            # and one-time substitution by neighbour AA.
+            # ==========================================
+            def window_hits(shifts_sorted, order):
+                # (base, shift index) for every hit, from the compiled window
+                # search; grouped by base, shifts in their original order
+                hit_base, hit_pos = window_pairs(base_arr, shifts_sorted, lo, hi)
+                hit_shift = order[hit_pos]
+                rows = np.lexsort((hit_shift, hit_base))
+                return zip(hit_base[rows].tolist(), hit_shift[rows].tolist())
+
+            # 0) fragment / substitution only
+            for b in np.nonzero((base_arr >= lo) & (base_arr <= hi))[0]:
+                add_result(base_label(b), bases[b], base_steps(b), results, target_mass, prefix, window)
+
+            # 1) + one modification
+            for b, i in window_hits(single_sorted, single_order):
+                m = signed_mods[i]
+                add_result(f"{base_label(b)} {m:+.5f}", bases[b] + m, base_steps(b) + [m], results, target_mass, prefix, window)
+
+            # 2) + two modifications
+            for b, i in window_hits(pair_sorted, pair_order):
+                m1, m2 = signed_mods[pair_idx[i, 0]], signed_mods[pair_idx[i, 1]]
+                add_result(
+                    f"{base_label(b)} {m1:+.5f} {m2:+.5f}",
+                    bases[b] + (m1 + m2),
+                    base_steps(b) + [m1, m2],
+                    results,
+                    target_mass,
+                    prefix,
+                    window,
+                )
+            tick(len(bases) * per_base)
+
+    return results
+
+@st.cache_data(show_spinner=False)
+def parse_dataset(name, main_tuple, list2_tuple):
+    """
+    Split a dataset into (main_list, mods, total_main). `mods` holds the
+    distinct "+" and "-" modifier values, ascending, as lists ("add", "sub")
+    for the labels and as float64 arrays ("add_arr", "sub_arr") for the
+    search kernels, plus "sub_limit": how many times each "-" value may be
+    used in one combination. Cached per dataset content (`name` just makes
+    the cache entries easy to tell apart), so widget reruns skip the
+    parsing. Pass tuples: the arguments have to be hashable.
+    """
+    main = [float(x) for x in main_tuple]
+
+    # --- Parse modifiers (handles extra quotes & exact Code 1 behaviour) ---
+    list2_add, list2_sub = [], []
+
+    for item in list2_tuple:
+        # Normalize weird Supabase cases like "'+56.06'"
+        s = str(item).strip().strip("'").strip('"')
+        try:
+            if s.startswith('+'):
+                list2_add.append(float(s[1:]))
+            elif s.startswith('-'):
+                list2_sub.append(abs(float(s)))
             else:
-                list2_sub.append(abs(val))
-    except ValueError:
-        pass
+                val = float(s)
+                if val >= 0:
+                    list2_add.append(val)
+                    list2_sub.append(val)
+                else:
+                    list2_sub.append(abs(val))
+        except ValueError:
+            pass
+
+    # Repeated modifiers (e.g. "18.011" next to "-18.011") only yield the same
+    # combinations again, so each distinct value is searched once, in
+    # ascending order. Subtractions draw without repetition, so how often a
+    # value was listed is kept: that is how many times it may be subtracted.
+    sub_uses = Counter(list2_sub)
+    list2_add = sorted(set(list2_add))
+    list2_sub = sorted(sub_uses)
+    mods = {
+        "add": list2_add,
+        "sub": list2_sub,
+        "add_arr": np.asarray(list2_add, dtype=np.float64),
+        "sub_arr": np.asarray(list2_sub, dtype=np.float64),
+        "sub_limit": np.array([sub_uses[x] for x in list2_sub], dtype=np.int64),
+    }
+
+    return main, mods, sum(main)
+
+main_list, mods, total_main = parse_dataset(
+    selected_name, tuple(main_list), tuple(list2_raw)
+)
 
 # ════════════════════════════════════════════════
 # ▶️ Run Match Search
 # ════════════════════════════════════════════════
+MAX_SHOWN = 200  # result rows rendered; the full match count is still reported
+
 st.divider()
 if st.button("▶️ Run Matching Search"):
     # Build list of target masses to search
@@ -447,316 +943,59 @@ if st.button("▶️ Run Matching Search"):
                     prefix = f"m/z={mz_value:.5f}, z={z}"
                     target_pairs.append((target_mass, prefix))
 
-    results = []
-    total_main = sum(main_list)
     progress = st.progress(0)
-    done = 0
-
-    if target_pairs:
-        for target_mass, prefix in target_pairs:
-            # Main-only
-            if run_main_only:
-                add_result(f"{selected_name} only", total_main, [], results, target_mass, prefix)
-
-            # + modifiers
-            if run_additions:
-                for r in range(1, 4):
-                    for combo in itertools.combinations_with_replacement(list2_add, r):
-                        add_result(f"+{combo}", total_main + sum(combo), combo, results, target_mass, prefix)
-                        done += 1
-                        if done % 200 == 0:
-                            progress.progress(min(done / 5000, 1.0))
-
-            # - modifiers
-            if run_subtractions:
-                for r in range(1, 4):
-                    for combo in itertools.combinations(list2_sub, r):
-                        add_result(f"-{combo}", total_main - sum(combo), combo, results, target_mass, prefix)
-                        done += 1
-                        if done % 200 == 0:
-                            progress.progress(min(done / 5000, 1.0))
-
-            # - and +
-            if run_sub_add:
-                for sub in list2_sub:
-                    for add in list2_add:
-                        if sub == add:
-                            continue
-                        add_result(
-                            f"-({sub},) +({add},)",
-                            total_main - sub + add,
-                            [sub, add],
-                            results,
-                            target_mass,
-                            prefix,
-                        )
-                        done += 1
-                        if done % 200 == 0:
-                            progress.progress(min(done / 5000, 1.0))
-
-                        # ────────────── NEW: Oligomers (Dimer/Trimer/Tetramer) ──────────────
-                       # ────────────── NEW: Oligomers (Dimer/Trimer/Tetramer) ──────────────
-            if run_oligomers and oligomer_mode is not None:
-                # X = 2,3,4 -> Dimer, Trimer, Tetramer
-                oligo_names = {2: "Dimer", 3: "Trimer", 4: "Tetramer"}
-                H2 = 2.014  # mass difference for H2 (used in your formulas)
-
-                for X in (2, 3, 4):
-                    label = oligo_names[X]
-
-                    if oligomer_mode == "Cyclic Monomer":
-                        # 1) Cyclic Oligomer: sum_main * X
-                        cyclic_mass = total_main * X
-                        # 2) Linear Oligomer: sum_main * X + 2.014
-                        linear_mass = total_main * X + H2
-
-                        # Peptide-bound oligomer is NOT defined for Cyclic Monomer mode
-                        peptide_mass = None
-
-                    else:
-                        # oligomer_mode == "Linear Monomer"
-                        # 1) Cyclic Oligomer:
-                        #    sum_main * X - ((X-1) * 2.014) - 2.014
-                        cyclic_mass = total_main * X - ((X - 1) * H2) - H2
-                        # 2) Linear Oligomer:
-                        #    sum_main * X - ((X-1) * 2.014)
-                        linear_mass = total_main * X - ((X - 1) * H2)
-                        # 3) Peptide-bound oligomer:
-                        #    sum_main * X  (your new rule)
-                        peptide_mass = total_main * X
-
-                    # Cyclic oligomer
-                    add_result(
-                        f"Cyclic {label}",
-                        cyclic_mass,
-                        [("oligomer", X, "cyclic")],
-                        results,
-                        target_mass,
-                        prefix,
-                    )
-                    done += 1
-                    if done % 200 == 0:
-                        progress.progress(min(done / 5000, 1.0))
-
-                    # Linear oligomer
-                    add_result(
-                        f"Linear {label}",
-                        linear_mass,
-                        [("oligomer", X, "linear")],
-                        results,
-                        target_mass,
-                        prefix,
-                    )
-                    done += 1
-                    if done % 200 == 0:
-                        progress.progress(min(done / 5000, 1.0))
-
-                    # Peptide-bound oligomer (only for Linear Monomer mode)
-                    if peptide_mass is not None:
-                        add_result(
-                            f"Peptide-bound {label}",
-                            peptide_mass,
-                            [("oligomer", X, "peptide_bound")],
-                            results,
-                            target_mass,
-                            prefix,
-                        )
-                        done += 1
-                        if done % 200 == 0:
-                            progress.progress(min(done / 5000, 1.0))
-
-
-
-            # ────────────── NEW Shorters-combos (List2-only logic) ──────────────
-            if run_list2_only:
-                # ==========================================
-                # Fragments of main_list with optional list2 mods
-                # and one-time substitution by neighbour AA.
-                # ==========================================
-                n = len(main_list)
-
-                # --- Precompute main masses as a set (for skipping overlaps) ---
-                main_masses_set = {round(float(x), 6) for x in main_list}
-
-                # --- Build signed modifiers from list2 ---
-                signed_mods = []
-                seen = set()
-
-                # positive shifts from list2_add
-                for v in list2_add:
-                    v = float(v)
-                    mag = round(abs(v), 6)
-                    if mag in main_masses_set:
-                        continue
-                    key = ('+', mag)
-                    if key not in seen:
-                        seen.add(key)
-                        signed_mods.append(v)  # +v
-
-                # negative shifts from list2_sub
-                for v in list2_sub:
-                    v = float(v)
-                    mag = round(abs(v), 6)
-                    if mag in main_masses_set:
-                        continue
-                    key = ('-', mag)
-                    if key not in seen:
-                        seen.add(key)
-                        signed_mods.append(-v)  # -v
-
-                # --- Prefix sums to get fragment masses quickly ---
-                prefix_sums = [0.0]
-                for x in main_list:
-                    prefix_sums.append(prefix_sums[-1] + float(x))
-
-                # Loop over all contiguous fragments i..j
-                for start in range(n):
-                    for end in range(start + 1, n + 1):
-                        frag_sum = prefix_sums[end] - prefix_sums[start]
-                        frag_label = f"{start + 1}-{end}"
-
-                        # 0) fragment only
-                        add_result(f"frag {frag_label}", frag_sum, [], results, target_mass, prefix)
-                        done += 1
-                        if done % 200 == 0:
-                            progress.progress(min(done / 5000, 1.0))
-
-                        # 1) fragment + list2 (no substitution)
-                        if signed_mods:
-                            # one modification
-                            for m in signed_mods:
-                                val = frag_sum + m
-                                desc = f"frag {frag_label} {m:+.5f}"
-                                add_result(desc, val, [m], results, target_mass, prefix)
-                                done += 1
-                                if done % 200 == 0:
-                                    progress.progress(min(done / 5000, 1.0))
-
-                            # two modifications
-                            for i_m, m1 in enumerate(signed_mods):
-                                for m2 in signed_mods[i_m:]:
-                                    total_mod = m1 + m2
-                                    val = frag_sum + total_mod
-                                    desc = f"frag {frag_label} {m1:+.5f} {m2:+.5f}"
-                                    add_result(desc, val, [m1, m2], results, target_mass, prefix)
-                                    done += 1
-                                    if done % 200 == 0:
-                                        progress.progress(min(done / 5000, 1.0))
-
-                        # 2) single substitution inside fragment
-                        for k in range(start, end):
-                            old_mass = float(main_list[k])
-                            pos_in_frag = k - start + 1
-
-                            neighbour_indices = []
-                            if k - 1 >= 0:
-                                neighbour_indices.append(k - 1)
-                            if k + 1 < n:
-                                neighbour_indices.append(k + 1)
-
-                            for neigh_idx in neighbour_indices:
-                                subst_mass = float(main_list[neigh_idx])
-
-                                if abs(subst_mass - old_mass) < 1e-9:
-                                    continue
-
-                                sub_base = frag_sum - old_mass + subst_mass
-                                base_desc = (
-                                    f"frag {frag_label} subst pos{pos_in_frag} "
-                                    f"{old_mass:.5f}->{subst_mass:.5f}"
-                                )
-
-                                # substitution ONLY
-                                add_result(base_desc, sub_base, [sub_base - frag_sum], results, target_mass, prefix)
-                                done += 1
-                                if done % 200 == 0:
-                                    progress.progress(min(done / 5000, 1.0))
-
-                                if not signed_mods:
-                                    continue
-
-                                # substitution + one mod
-                                for m in signed_mods:
-                                    val = sub_base + m
-                                    desc = f"{base_desc} {m:+.5f}"
-                                    add_result(desc, val, [sub_base - frag_sum, m], results, target_mass, prefix)
-                                    done += 1
-                                    if done % 200 == 0:
-                                        progress.progress(min(done / 5000, 1.0))
-
-                                # substitution + two mods
-                                for i_m, m1 in enumerate(signed_mods):
-                                    for m2 in signed_mods[i_m:]:
-                                        total_mod = m1 + m2
-                                        val = sub_base + total_mod
-                                        desc = f"{base_desc} {m1:+.5f} {m2:+.5f}"
-                                        add_result(
-                                            desc,
-                                            val,
-                                            [sub_base - frag_sum, m1, m2],
-                                            results,
-                                            target_mass,
-                                            prefix,
-                                        )
-                                        done += 1
-                                        if done % 200 == 0:
-                                            progress.progress(min(done / 5000, 1.0))
-
+    results = run_search(
+        main_list,
+        total_main,
+        mods,
+        {
+            "main_only": run_main_only,
+            "additions": run_additions,
+            "subtractions": run_subtractions,
+            "sub_add": run_sub_add,
+            "list2_only": run_list2_only,
+            "oligomer_mode": oligomer_mode if run_oligomers else None,
+        },
+        target_pairs,
+        tolerance,
+        selected_name,
+        progress,
+    )
     progress.progress(1.0)
 
-    if results:
-        st.success(f"✅ Found {len(results)} matches within ±{tolerance:.5f}")
-        for _, _, desc, val, err in sorted(results, key=lambda x: (x[0], x[1])):
-            st.write(f"🔹 `{desc}` = **{val:.5f}** (error: {err:.5f})")
-
-            # Extract numeric tokens with correct sign, including cases like "-(15.977,)"
-                   # Extract numeric tokens with correct sign, but ignore the [m/z=..., z=...] prefix
-        raw = str(desc)
-        nums = []
-
-        # If there is a prefix like "[m/z=..., z=...]", ignore numbers inside the brackets
-        bracket_end = raw.find(']')
-
-        for m in re.finditer(r'\d*\.?\d+', raw):
-            # Skip numbers that are inside the [m/z=..., z=...] prefix
-            if bracket_end != -1 and m.start() < bracket_end:
-                continue
-
-            x_str = m.group()
-            v = float(x_str)
-
-            # Default sign is +, but inspect characters before the number
-            sign = 1.0
-            j = m.start() - 1
-
-            # Skip whitespace going backwards
-            while j >= 0 and raw[j].isspace():
-                j -= 1
-
-            if j >= 0 and raw[j] in '()':
-                # If directly before the number is '(' or ')',
-                # look one more step back for a sign, like "-(" or "+("
-                k = j - 1
-                while k >= 0 and raw[k].isspace():
-                    k -= 1
-                if k >= 0 and raw[k] == '-':
-                    sign = -1.0
-                elif k >= 0 and raw[k] == '+':
-                    sign = 1.0
-            else:
-                # Otherwise, the sign may be directly before the number
-                if j >= 0 and raw[j] == '-':
-                    sign = -1.0
-                elif j >= 0 and raw[j] == '+':
-                    sign = 1.0
-
-            nums.append(sign * v)
-
-        # Show ALL matching names for each numeric value
-        for n in nums:
-            name_list = get_global_name(n)
-            for nm in name_list:
-                st.caption(f"↳ {n} → {nm}")
+    n_found = len(results["err"])
+    if n_found:
+        st.success(f"✅ Found {n_found} matches within ±{tolerance:.5f}")
+        if n_found > MAX_SHOWN:
+            st.caption(f"Showing the best {MAX_SHOWN} (fewest steps, then smallest error).")
+        # Fewest steps, then smallest error, then description: one C-level
+        # sort over the columns
+        order = np.lexsort((
+            np.array(results["desc"]),
+            np.array(results["err"]),
+            np.array(results["size"]),
+        ))[:MAX_SHOWN]
+        rows = []
+        for i in order:
+            desc, val, err, steps = (results[c][i] for c in ("desc", "val", "err", "steps"))
+            # ALL matching global names for each numeric shift of the match
+            names = [
+                f"{n:+.5f} → {nm}"
+                for n in steps
+                if isinstance(n, float)
+                for nm in get_global_name(n)
+            ]
+            rows.append({"Description": desc, "Mass": val, "Error": err, "Global names": "; ".join(names)})
+
+        # One element for all matches instead of a write/caption per row
+        st.dataframe(
+            pd.DataFrame(rows),
+            hide_index=True,
+            column_config={
+                "Mass": st.column_config.NumberColumn(format="%.5f"),
+                "Error": st.column_config.NumberColumn(format="%.5f"),
+            },
+        )
 
     else:
         st.warning("No matches found.")
@@ -0,0 +1,164 @@
+"""
+Numeric kernels for the MassMatchFinder search.
+
+Kept out of mass_match_app.py on purpose: Streamlit re-executes the app
+script on every rerun, while an imported module (and its compiled Numba
+functions) is loaded once per server process.
+"""
+import numpy as np
+from numba import njit
+
+
+# ════════════════════════════════════════════════
+# 🔢 Bounded combination search
+# ════════════════════════════════════════════════
+@njit(cache=True)
+def _walk(v, r, lo, hi, first, fill, idx_out, sum_out, k):
+    """
+    Depth-first walk over the r-element combinations (with repetition) of
+    the ascending array `v` that start at index `first`, keeping those whose
+    sum lies in [lo, hi]. Returns the number of hits; with `fill` set they
+    are also written to idx_out/sum_out from row `k` on.
+
+    The walk keeps its state in an index stack. At each depth the smallest
+    and largest sums still reachable from the current prefix are checked
+    against the window: too large ends the loop at that depth (later values
+    are only larger), too small skips to the next value.
+    """
+    n = v.shape[0]
+    stack = np.zeros(r, dtype=np.int64)
+    partial = np.zeros(r + 1, dtype=np.float64)
+    count = 0
+    stack[0] = first
+    depth = 0
+    while depth >= 0:
+        i = stack[depth]
+        left = r - depth
+        if i > n - 1 or (depth == 0 and i != first):
+            # Nothing more at this depth: back up and advance the parent
+            depth -= 1
+            if depth >= 0:
+                stack[depth] += 1
+            continue
+        cur = partial[depth]
+        smallest = cur + v[i] * left
+        largest = cur + v[i] + v[n - 1] * (left - 1)
+        if smallest > hi:
+            # Later values are only larger: this depth is exhausted too
+            depth -= 1
+            if depth >= 0:
+                stack[depth] += 1
+            continue
+        if largest < lo:
+            stack[depth] += 1
+            continue
+        if left == 1:
+            # smallest == largest == cur + v[i], and it is inside the window
+            if fill:
+                idx_out[k + count] = stack
+                sum_out[k + count] = smallest
+            count += 1
+            stack[depth] += 1
+            continue
+        partial[depth + 1] = cur + v[i]
+        stack[depth + 1] = i
+        depth += 1
+    return count
+
+
+@njit(cache=True)
+def search_combos(v, r, lo, hi):
+    """
+    Enumerate r-element combinations (with repetition) of the ascending
+    array `v` whose sum lies in [lo, hi]. Returns (idx, sums): an (k, r)
+    array of indices into `v` and the k matching sums, rows in
+    lexicographic index order.
+
+    The subtrees under each first index are walked twice: once to count the
+    hits, once to write them into their slice of the exactly-sized output.
+
+    Serial on purpose: Streamlit runs sessions in threads, Numba's only
+    always-available parallel layer (workqueue) aborts the process on
+    concurrent calls, and TBB keeps it from exiting. The walks take
+    milliseconds anyway.
+    """
+    n = v.shape[0]
+    if n == 0 or r <= 0:
+        return np.empty((0, max(r, 0)), dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    no_idx = np.empty((0, r), dtype=np.int64)
+    no_sum = np.empty(0, dtype=np.float64)
+    counts = np.zeros(n, dtype=np.int64)
+    for first in range(n):
+        counts[first] = _walk(v, r, lo, hi, first, False, no_idx, no_sum, 0)
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    for first in range(n):
+        offsets[first + 1] = offsets[first] + counts[first]
+    idx_out = np.empty((offsets[n], r), dtype=np.int64)
+    sum_out = np.empty(offsets[n], dtype=np.float64)
+    for first in range(n):
+        if counts[first] > 0:
+            _walk(v, r, lo, hi, first, True, idx_out, sum_out, offsets[first])
+
+    return idx_out, sum_out
+
+
+def bounded_combos(values, r, lo, hi):
+    """
+    Index rows (into `values`) of the r-element combinations with repetition
+    whose sum lies in [lo, hi], in the same order
+    itertools.combinations_with_replacement would yield them, and the
+    matching sums. Returns (idx, sums) as NumPy arrays.
+    """
+    v = np.asarray(values, dtype=np.float64)
+    order = np.argsort(v, kind="stable")
+    idx, sums = search_combos(v[order], r, float(lo), float(hi))
+    # Back to positions in `values`, each row ascending, rows in itertools order
+    idx = np.sort(order[idx], axis=1)
+    rows = np.lexsort(idx.T[::-1])
+    return idx[rows], sums[rows]
+
+
+# ════════════════════════════════════════════════
+# 🧬 Base + shift window search
+# ════════════════════════════════════════════════
+@njit(cache=True)
+def window_pairs(bases, shifts, lo, hi):
+    """
+    All (base, shift) index pairs with lo <= bases[b] + shifts[s] <= hi, for
+    an ascending `shifts`. Each base binary-searches its window, so the cost
+    is O(B log S + hits); like search_combos, it counts then fills. Pairs come out grouped by base, shift positions ascending.
+    """
+    nb = bases.shape[0]
+    first = np.empty(nb, dtype=np.int64)
+    last = np.empty(nb, dtype=np.int64)
+    counts = np.zeros(nb, dtype=np.int64)
+    for b in range(nb):
+        # The 1e-9 margin leaves the exact decision to the sum test below
+        a = np.searchsorted(shifts, lo - bases[b] - 1e-9, side="left")
+        z = np.searchsorted(shifts, hi - bases[b] + 1e-9, side="right")
+        c = 0
+        for j in range(a, z):
+            v = bases[b] + shifts[j]
+            if v >= lo and v <= hi:
+                c += 1
+        first[b] = a
+        last[b] = z
+        counts[b] = c
+
+    offsets = np.zeros(nb + 1, dtype=np.int64)
+    for b in range(nb):
+        offsets[b + 1] = offsets[b] + counts[b]
+    base_out = np.empty(offsets[nb], dtype=np.int64)
+    shift_out = np.empty(offsets[nb], dtype=np.int64)
+    for b in range(nb):
+        k = offsets[b]
+        for j in range(first[b], last[b]):
+            v = bases[b] + shifts[j]
+            if v >= lo and v <= hi:
+                base_out[k] = b
+                shift_out[k] = j
+                k += 1
+
+    return base_out, shift_out
@@ -0,0 +1,12 @@
+-- Bulk upsert for the global modifier names, so the app can save many
+-- entries in one round-trip:
+--   supabase.rpc("upsert_global_names", {"payload": [{"number": ..., "name": ...}, ...]})
+create or replace function public.upsert_global_names(payload jsonb)
+returns void
+language sql
+as $$
+  insert into public.global_names (number, name)
+  select r ->> 'number', r ->> 'name'
+  from jsonb_array_elements(payload) as r
+  on conflict (number) do update set name = excluded.name;
+$$;
@@ -0,0 +1,6 @@
+-- Store the dataset lists as jsonb, so PostgREST returns them already decoded
+-- and the app no longer json.loads() each row. Existing text values are JSON
+-- arrays written by json.dumps(), so they cast directly.
+alter table public.datasets
+  alter column main_list type jsonb using main_list::jsonb,
+  alter column list2_list type jsonb using list2_list::jsonb;
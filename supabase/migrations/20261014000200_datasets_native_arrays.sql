@@ -0,0 +1,25 @@
+-- Store the dataset lists as native Postgres arrays: main_list as
+-- double precision[] and list2_list as text[] (modifiers keep their "+x" /
+-- "-x" prefixes). PostgREST returns both as plain JSON arrays, so the app
+-- needs no JSON decoding at all.
+create function pg_temp.jsonb_to_float8_array(j jsonb)
+returns double precision[]
+language sql
+immutable
+as $$
+  select coalesce(array_agg(e.x::double precision order by e.i), '{}')
+  from jsonb_array_elements_text(j) with ordinality as e(x, i);
+$$;
+
+create function pg_temp.jsonb_to_text_array(j jsonb)
+returns text[]
+language sql
+immutable
+as $$
+  select coalesce(array_agg(e.x order by e.i), '{}')
+  from jsonb_array_elements_text(j) with ordinality as e(x, i);
+$$;
+
+alter table public.datasets
+  alter column main_list type double precision[] using pg_temp.jsonb_to_float8_array(main_list),
+  alter column list2_list type text[] using pg_temp.jsonb_to_text_array(list2_list);
@@ -0,0 +1,90 @@
+"""
+Brute-force checks for the mass_search kernels: every result must match a
+plain itertools / nested-loop scan over the same inputs.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+from mass_search import bounded_combos, window_pairs
+
+
+def brute_combos(values, r, lo, hi):
+    rows = [
+        c for c in itertools.combinations_with_replacement(range(len(values)), r)
+        if lo <= sum(values[i] for i in c) <= hi
+    ]
+    return rows, [sum(values[i] for i in c) for c in rows]
+
+
+def brute_pairs(bases, shifts, lo, hi):
+    return [
+        (b, s)
+        for b in range(len(bases))
+        for s in range(len(shifts))
+        if lo <= bases[b] + shifts[s] <= hi
+    ]
+
+
+def check_combos(values, r, lo, hi):
+    idx, sums = bounded_combos(values, r, lo, hi)
+    rows, expected = brute_combos(values, r, lo, hi)
+    assert [tuple(row) for row in idx.tolist()] == rows
+    np.testing.assert_allclose(sums, expected)
+
+
+def check_pairs(bases, shifts, lo, hi):
+    base_out, shift_out = window_pairs(
+        np.asarray(bases, dtype=np.float64), np.asarray(shifts, dtype=np.float64), lo, hi
+    )
+    assert list(zip(base_out.tolist(), shift_out.tolist())) == brute_pairs(bases, shifts, lo, hi)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_bounded_combos_random(seed):
+    rng = np.random.default_rng(seed)
+    # Unsorted input with repeats: the kernel sorts, results follow `values`
+    values = rng.choice(rng.uniform(0, 60, 8), size=rng.integers(1, 12)).tolist()
+    for r in (1, 2, 3):
+        lo = rng.uniform(0, 60 * r)
+        check_combos(values, r, lo, lo + rng.uniform(0, 20))
+
+
+def test_bounded_combos_empty():
+    idx, sums = bounded_combos([], 2, 0.0, 100.0)
+    assert idx.shape == (0, 2) and sums.shape == (0,)
+    check_combos([1.0, 2.0], 2, 10.0, 20.0)
+    check_combos([5.0, 2.0], 2, 8.0, 3.0)
+
+
+def test_bounded_combos_window_edges():
+    # Whole numbers sum exactly, so sums equal to lo or hi must be kept
+    values = [3.0, 1.0, 4.0, 2.0]
+    for r in (1, 2, 3):
+        for lo in range(0, 13):
+            check_combos(values, r, float(lo), float(lo))
+            check_combos(values, r, float(lo), float(lo + 2))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_window_pairs_random(seed):
+    rng = np.random.default_rng(seed)
+    bases = rng.uniform(100, 200, rng.integers(1, 30)).tolist()
+    shifts = np.sort(rng.uniform(-20, 20, rng.integers(1, 30))).tolist()
+    lo = rng.uniform(90, 210)
+    check_pairs(bases, shifts, lo, lo + rng.uniform(0, 10))
+
+
+def test_window_pairs_empty():
+    check_pairs([], [1.0, 2.0], 0.0, 10.0)
+    check_pairs([1.0, 2.0], [], 0.0, 10.0)
+    check_pairs([1.0, 2.0], [1.0, 2.0], 10.0, 20.0)
+
+
+def test_window_pairs_window_edges():
+    bases = [10.0, 12.0, 11.0]
+    shifts = [-2.0, 0.0, 1.0, 1.0, 3.0]
+    for lo in range(6, 17):
+        check_pairs(bases, shifts, float(lo), float(lo))
+        check_pairs(bases, shifts, float(lo), float(lo + 1))